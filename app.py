@@ -1,10 +1,18 @@
 import os
-import json
 import datetime
-import uuid
-from flask import Flask, request, jsonify, send_file, render_template, url_for, redirect
+import secrets
+from urllib.parse import unquote
+import threading
+import queue
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from functools import lru_cache, wraps
+from flask import Flask, Response, request, jsonify, send_from_directory, render_template, url_for, redirect
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import NotFound, RequestEntityTooLarge
 import logging
+import orjson
 
 app = Flask(__name__)
 
@@ -14,35 +22,328 @@ logger = logging.getLogger(__name__)
 
 # Конфигурация
 STORAGE_DIR = "storage"
-METADATA_FILE = os.path.join(STORAGE_DIR, "metadata.json")
+METADATA_DB = os.path.join(STORAGE_DIR, "meta.db")
+METADATA_FILE = os.path.join(STORAGE_DIR, "metadata.json")  # устаревший формат, импортируется в БД
+METADATA_MMAP_SIZE = 64 * 1024 * 1024  # сколько байт БД читать через mmap
+WRITE_BATCH_SIZE = 64  # максимум операций записи в одной транзакции
+WRITE_TIMEOUT = 30  # сколько запрос ждет фиксации своей записи, сек
 MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
-ALLOWED_EXTENSIONS = {'txt', 'pdf', 'png', 'jpg', 'jpeg', 'gif', 'doc', 'docx', 'xls', 'xlsx', 'zip'}
+UPLOAD_CHUNK_SIZE = 64 * 1024  # тело загрузки пишется на диск блоками
+ALLOWED_EXTENSIONS = frozenset({'.txt', '.pdf', '.png', '.jpg', '.jpeg', '.gif', '.doc', '.docx', '.xls', '.xlsx', '.zip'})
+
+app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
+
+# За веб-сервером с поддержкой X-Sendfile содержимое файлов отдает он сам,
+# иначе send_file передает файл в wsgi.file_wrapper (sendfile в gunicorn)
+if os.environ.get('X_SENDFILE'):
+    app.config['USE_X_SENDFILE'] = True
 
 # Создаем директорию для хранения файлов при запуске
 os.makedirs(STORAGE_DIR, exist_ok=True)
 
-# Инициализируем файл метаданных
-def init_metadata():
+def allowed_file(filename):
+    return os.path.splitext(filename)[1].lower() in ALLOWED_EXTENSIONS
+
+@lru_cache(maxsize=2048)
+def _secure(filename):
+    """secure_filename с кэшем: клиенты часто повторяют одни и те же имена"""
+    return secure_filename(filename)
+
+# Метаданные хранятся в SQLite (режим WAL): выборки и агрегаты считаются
+# по индексам внутри БД, а не загрузкой всего списка в Python.
+# У каждого потока свое соединение: в режиме WAL чтения идут параллельно.
+#
+# Под gevent (GUNICORN_WORKER_CLASS=gevent) threading.local привязан
+# к гринлету, а блокирующие вызовы sqlite3 останавливают весь цикл событий.
+# Поэтому там обращения к БД выполняются в настоящих потоках пула хаба
+# gevent, и соединения хранятся по одному на такой поток
+try:
+    from gevent import monkey as _gevent_monkey
+    _GEVENT = _gevent_monkey.is_module_patched('threading')
+except ImportError:
+    _GEVENT = False
+
+if _GEVENT:
+    import gevent
+    _DB_LOCAL = _gevent_monkey.get_original('_thread', '_local')()
+else:
+    _DB_LOCAL = threading.local()
+
+def _db_call(func):
+    """Под gevent выполняет обращение к SQLite в потоке пула хаба, не блокируя цикл событий"""
+    if not _GEVENT:
+        return func
+    
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        return gevent.get_hub().threadpool.apply(func, args, kwargs)
+    return wrapper
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    unique_name TEXT PRIMARY KEY,
+    original_name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    upload_date TEXT NOT NULL,
+    path TEXT NOT NULL,
+    subdir TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_files_upload_date ON files (upload_date DESC);
+"""
+
+# Версия 2: счетчик изменений списка файлов, общий для всех воркеров.
+# Триггеры содержат ';', поэтому операторы перечислены по отдельности
+SCHEMA_V2 = [
+    "CREATE TABLE IF NOT EXISTS files_version (id INTEGER PRIMARY KEY CHECK (id = 1), version INTEGER NOT NULL)",
+    "INSERT OR IGNORE INTO files_version (id, version) VALUES (1, 0)",
+    "CREATE TRIGGER IF NOT EXISTS files_version_insert AFTER INSERT ON files "
+    "BEGIN UPDATE files_version SET version = version + 1; END",
+    "CREATE TRIGGER IF NOT EXISTS files_version_delete AFTER DELETE ON files "
+    "BEGIN UPDATE files_version SET version = version + 1; END",
+]
+
+# Версия 3: случайный токен, создаваемый вместе с БД. Счетчик версии
+# у новой БД снова начинается с 0, токен отличает ее от прежней
+SCHEMA_V3 = [
+    "ALTER TABLE files_version ADD COLUMN token TEXT NOT NULL DEFAULT ''",
+    "UPDATE files_version SET token = lower(hex(randomblob(8)))",
+]
+
+def _import_legacy_metadata(conn):
+    """Переносит записи из metadata.json, если он остался от старой версии"""
     if not os.path.exists(METADATA_FILE):
-        with open(METADATA_FILE, 'w') as f:
-            json.dump({}, f)
+        return
+    metadata = orjson.loads(Path(METADATA_FILE).read_bytes())
+    conn.executemany(
+        "INSERT OR IGNORE INTO files (unique_name, original_name, size, upload_date, path, subdir) "
+        "VALUES (:unique_name, :original_name, :size, :upload_date, :path, :subdir)",
+        list(metadata.values())
+    )
+    logger.info(f"Imported {len(metadata)} entries from {METADATA_FILE}")
 
-init_metadata()
+def _connect_db():
+    """Открывает соединение с БД метаданных"""
+    conn = sqlite3.connect(METADATA_DB, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA busy_timeout=5000")
+    conn.execute("PRAGMA journal_mode=WAL")
+    # Каждая фиксация делает fsync журнала WAL; чтения это не замедляет
+    conn.execute("PRAGMA synchronous=FULL")
+    # Страницы БД читаются из отображенной в память области, без read() на каждую
+    conn.execute(f"PRAGMA mmap_size={METADATA_MMAP_SIZE}")
+    return conn
 
-def allowed_file(filename):
-    return '.' in filename and filename.split('.')[-1].lower() in ALLOWED_EXTENSIONS
+def init_db():
+    """Открывает БД метаданных и создает схему при первом запуске"""
+    conn = _connect_db()
+    # BEGIN IMMEDIATE - чтобы несколько воркеров не создавали схему одновременно
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if conn.execute("PRAGMA user_version").fetchone()[0] == 0:
+            for statement in SCHEMA.split(';'):
+                if statement.strip():
+                    conn.execute(statement)
+            _import_legacy_metadata(conn)
+            conn.execute("PRAGMA user_version = 1")
+        if conn.execute("PRAGMA user_version").fetchone()[0] == 1:
+            for statement in SCHEMA_V2:
+                conn.execute(statement)
+            conn.execute("PRAGMA user_version = 2")
+        if conn.execute("PRAGMA user_version").fetchone()[0] == 2:
+            for statement in SCHEMA_V3:
+                conn.execute(statement)
+            conn.execute("PRAGMA user_version = 3")
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+init_db()
+
+def get_db():
+    """Соединение с БД метаданных для текущего потока (открывается при первом обращении)"""
+    conn = getattr(_DB_LOCAL, 'conn', None)
+    if conn is None:
+        conn = _DB_LOCAL.conn = _connect_db()
+    return conn
+
+# Записи метаданных выполняет один фоновый поток: операции, накопившиеся
+# в очереди за время предыдущей фиксации, фиксируются одной транзакцией
+# (один fsync на пачку). Одиночная запись не ждет попутчиков
+_WRITE_QUEUE = queue.Queue()
+# Под этой блокировкой писатель забирает операцию, а запрос по таймауту
+# отменяет ее: отмененная операция не выполняется, начатая - не отменяется
+_WRITE_CLAIM_LOCK = threading.Lock()
+
+def _metadata_writer():
+    """Фоновый поток записи метаданных пачками"""
+    conn = None
+    while True:
+        batch = [_WRITE_QUEUE.get()]
+        # Добираем уже стоящие в очереди операции, но не больше WRITE_BATCH_SIZE
+        while len(batch) < WRITE_BATCH_SIZE:
+            try:
+                batch.append(_WRITE_QUEUE.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            if conn is None:
+                conn = _connect_db()
+            conn.execute("BEGIN IMMEDIATE")
+            for sql, params, done, result in batch:
+                with _WRITE_CLAIM_LOCK:
+                    if result.get('cancelled'):
+                        continue
+                    result['started'] = True
+                # Ошибка одной операции (например, дубликат ключа) не отменяет остальные
+                try:
+                    result['rowcount'] = conn.execute(sql, params).rowcount
+                except sqlite3.IntegrityError as e:
+                    result['error'] = e
+            conn.execute("COMMIT")
+        except Exception as e:
+            logger.error(f"Metadata write error: {e}")
+            for sql, params, done, result in batch:
+                result['error'] = e
+            # Состояние соединения неизвестно: закрываем (незавершенная
+            # транзакция откатится) и откроем заново на следующей пачке
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+                conn = None
+        finally:
+            for sql, params, done, result in batch:
+                done.set()
+
+@_db_call
+def _write_now(sql, params):
+    """Выполняет одну запись отдельной транзакцией (под gevent вместо фонового писателя)"""
+    conn = get_db()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        rowcount = conn.execute(sql, params).rowcount
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return rowcount
+
+def _execute_write(sql, params):
+    """Ставит операцию записи в очередь и ждет ее фиксации, возвращает rowcount"""
+    if _GEVENT:
+        # Поток-писатель под gevent был бы гринлетом и блокировал бы цикл
+        # событий на каждом fsync; пишем сразу в потоке пула хаба
+        return _write_now(sql, params)
+    done = threading.Event()
+    result = {}
+    _WRITE_QUEUE.put((sql, params, done, result))
+    if not done.wait(WRITE_TIMEOUT):
+        with _WRITE_CLAIM_LOCK:
+            if not result.get('started'):
+                # Писатель до операции не дошел - отменяем, чтобы она не
+                # зафиксировалась после того, как запрос уже получил ошибку
+                result['cancelled'] = True
+                raise TimeoutError('Metadata write timed out')
+        # Операция уже в транзакции - ждем фиксации или отката
+        if not done.wait(WRITE_TIMEOUT):
+            raise TimeoutError('Metadata write still pending')
+    if 'error' in result:
+        raise result['error']
+    return result['rowcount']
+
+if not _GEVENT:
+    threading.Thread(target=_metadata_writer, name='metadata-writer', daemon=True).start()
+
+@_db_call
+def get_file_info(unique_name):
+    """Возвращает метаданные файла или None"""
+    row = get_db().execute("SELECT * FROM files WHERE unique_name = ?", (unique_name,)).fetchone()
+    return dict(row) if row is not None else None
+
+def add_file_info(entry):
+    """Сохраняет метаданные нового файла"""
+    _execute_write(
+        "INSERT INTO files (unique_name, original_name, size, upload_date, path, subdir) "
+        "VALUES (:unique_name, :original_name, :size, :upload_date, :path, :subdir)",
+        entry
+    )
+
+def remove_file_info(unique_name):
+    """Удаляет метаданные файла, возвращает True если запись была"""
+    return _execute_write("DELETE FROM files WHERE unique_name = ?", (unique_name,)) > 0
+
+@_db_call
+def query_files(limit=None):
+    """Файлы, отсортированные по дате загрузки (новые сверху)"""
+    rows = get_db().execute(
+        "SELECT * FROM files ORDER BY upload_date DESC LIMIT ?",
+        (limit if limit is not None else -1,)
+    ).fetchall()
+    return [dict(row) for row in rows]
+
+@_db_call
+def files_version():
+    """Версия списка файлов: (токен БД, счетчик, растущий при загрузке и удалении)"""
+    return tuple(get_db().execute("SELECT token, version FROM files_version").fetchone())
+
+@_db_call
+def count_files():
+    """Количество и суммарный размер файлов"""
+    return tuple(get_db().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM files").fetchone())
+
+@_db_call
+def query_stats_by_date():
+    """Количество и размер файлов по дням загрузки"""
+    rows = get_db().execute(
+        "SELECT substr(upload_date, 1, 10) AS date, COUNT(*) AS count, SUM(size) AS total_size "
+        "FROM files GROUP BY date"
+    ).fetchall()
+    return {row['date']: {'count': row['count'], 'total_size': row['total_size']} for row in rows}
+
+def _scan_files(path):
+    """Рекурсивно перечисляет файлы через os.scandir: (каталог, имя).
+
+    Тип записи берется из readdir, без отдельного stat на каждый файл.
+    """
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                yield from _scan_files(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                yield path, entry.name
 
-def load_metadata():
-    with open(METADATA_FILE, 'r') as f:
-        return json.load(f)
+def build_untracked_index():
+    """Индекс файлов в каталогах по датам, которых нет в метаданных: имя -> каталог.
 
-def save_metadata(metadata):
-    with open(METADATA_FILE, 'w') as f:
-        json.dump(metadata, f, indent=2)
+    Строится один раз при старте, чтобы /files/ не обходил хранилище на каждый промах.
+    Каталоги годов независимы и сканируются параллельно.
+    """
+    known = {row[0] for row in get_db().execute("SELECT unique_name FROM files")}
+    # Служебные файлы в корне хранилища (БД, metadata.json) не отдаем
+    with os.scandir(STORAGE_DIR) as it:
+        year_dirs = [entry.path for entry in it if entry.is_dir(follow_symlinks=False)]
+    index = {}
+    if not year_dirs:
+        return index
+    with ThreadPoolExecutor(max_workers=min(8, len(year_dirs))) as pool:
+        for files in pool.map(lambda path: list(_scan_files(path)), year_dirs):
+            for root, name in files:
+                if name not in known:
+                    index[name] = root
+    return index
 
-def get_date_subdir():
-    """Создает подкаталог на основе текущей даты"""
-    today = datetime.datetime.now()
+_UNTRACKED_FILES = build_untracked_index()
+
+def json_response(payload):
+    """JSON-ответ, сериализованный через orjson (быстрее jsonify)"""
+    return Response(orjson.dumps(payload), mimetype='application/json')
+
+def get_date_subdir(today):
+    """Создает подкаталог на основе даты загрузки"""
     year = today.strftime("%Y")
     month = today.strftime("%m")
     day = today.strftime("%d")
@@ -53,16 +354,32 @@ def get_date_subdir():
 
 @app.before_request
 def log_request_info():
-    """Логирование запросов для отладки"""
-    logger.info(f"Request: {request.method} {request.path}")
-    logger.info(f"Headers: {dict(request.headers)}")
+    """Логирование запросов для отладки (только на уровне DEBUG)"""
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Request: %s %s", request.method, request.path)
+        logger.debug("Headers: %s", request.headers)
+
+# Отрисованная главная страница и версия списка файлов, для которой она
+# отрисована: пока файлы не менялись, шаблон повторно не выполняется
+_INDEX_CACHE = (None, None)
+_INDEX_TEMPLATE_MTIME = int(os.path.getmtime(os.path.join(app.root_path, 'templates', 'index.html')))
 
 @app.route('/')
 def index():
     """Главная страница с приветствием и формой загрузки"""
+    global _INDEX_CACHE
     try:
-        files = get_files_list()
-        return render_template('index.html', files=files)
+        version = files_version()
+        cached_version, html = _INDEX_CACHE
+        if cached_version != version:
+            html = render_template('index.html', files=query_files())
+            _INDEX_CACHE = (version, html)
+        
+        response = Response(html, mimetype='text/html')
+        response.headers['Cache-Control'] = 'private, must-revalidate'
+        token, counter = version
+        response.set_etag(f"{token}-{counter}-{_INDEX_TEMPLATE_MTIME}")
+        return response.make_conditional(request)
     except Exception as e:
         logger.error(f"Error in index: {e}")
         return f"Error: {e}", 500
@@ -72,134 +389,188 @@ def health():
     """Проверка здоровья приложения"""
     return jsonify({"status": "ok", "message": "App is running"})
 
+def store_upload(filename, write):
+    """Сохраняет загружаемый файл под уникальным именем и записывает метаданные.
+
+    write(dst) пишет содержимое в открытый файл и возвращает его размер.
+    """
+    if filename == '':
+        return jsonify({'error': 'No selected file'}), 400
+    
+    if not allowed_file(filename):
+        return jsonify({'error': f'File type not allowed. Allowed: {", ".join(sorted(ext[1:] for ext in ALLOWED_EXTENSIONS))}'}), 400
+    
+    # Генерируем уникальное имя файла
+    original_filename = _secure(filename)
+    name, ext = os.path.splitext(original_filename)
+    now = datetime.datetime.now()
+    unique_id = secrets.token_urlsafe(6)
+    timestamp = now.strftime("%Y%m%d_%H%M%S")
+    unique_filename = f"{name}_{timestamp}_{unique_id}{ext}"
+    
+    # Создаем подкаталог по дате
+    date_subdir, storage_path = get_date_subdir(now)
+    file_path = os.path.join(storage_path, unique_filename)
+    
+    # Сохраняем файл
+    try:
+        with open(file_path, 'wb') as dst:
+            file_size = write(dst)
+    except Exception:
+        # Не оставляем на диске недогруженный файл
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        raise
+    logger.info(f"File saved: {file_path}")
+    
+    # Создаем метаданные
+    entry = {
+        'original_name': original_filename,
+        'unique_name': unique_filename,
+        'size': file_size,
+        'upload_date': now.isoformat(),
+        'path': os.path.join(date_subdir, unique_filename),
+        'subdir': date_subdir
+    }
+    
+    try:
+        add_file_info(entry)
+    except Exception:
+        # Без записи в метаданных файл не виден в списке - не оставляем его
+        os.remove(file_path)
+        raise
+    logger.info(f"Metadata saved for {unique_filename}")
+    
+    return jsonify({
+        'success': True,
+        'message': 'File uploaded successfully',
+        'file': with_size_human(entry)
+    }), 200
+
+def _copy_request_stream(dst):
+    """Копирует тело запроса в файл блоками, возвращает число байт"""
+    file_size = 0
+    while chunk := request.stream.read(UPLOAD_CHUNK_SIZE):
+        file_size += len(chunk)
+        # Без Content-Length (chunked) лимит проверяем по факту
+        if file_size > MAX_CONTENT_LENGTH:
+            raise RequestEntityTooLarge()
+        dst.write(chunk)
+    return file_size
+
 @app.route('/upload', methods=['POST'])
 def upload_file():
-    """Загружает файл в облачное хранилище с метаданными"""
+    """Загружает файл в облачное хранилище с метаданными (multipart/form-data, поле file)"""
     try:
         if 'file' not in request.files:
             return jsonify({'error': 'No file part'}), 400
         
         file = request.files['file']
         
-        if file.filename == '':
-            return jsonify({'error': 'No selected file'}), 400
-        
-        if not allowed_file(file.filename):
-            return jsonify({'error': f'File type not allowed. Allowed: {ALLOWED_EXTENSIONS}'}), 400
-        
-        # Генерируем уникальное имя файла
-        original_filename = secure_filename(file.filename)
-        name, ext = os.path.splitext(original_filename)
-        unique_id = uuid.uuid4().hex[:8]
-        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        unique_filename = f"{name}_{timestamp}_{unique_id}{ext}"
-        
-        # Создаем подкаталог по дате
-        date_subdir, storage_path = get_date_subdir()
-        file_path = os.path.join(storage_path, unique_filename)
+        def write(dst):
+            file.save(dst)
+            return dst.tell()
         
-        # Сохраняем файл
-        file.save(file_path)
-        logger.info(f"File saved: {file_path}")
+        return store_upload(file.filename, write)
         
-        # Получаем размер файла
-        file_size = os.path.getsize(file_path)
-        
-        # Создаем метаданные
-        metadata = load_metadata()
-        file_id = unique_filename
-        metadata[file_id] = {
-            'original_name': original_filename,
-            'unique_name': unique_filename,
-            'size': file_size,
-            'size_human': format_size(file_size),
-            'upload_date': datetime.datetime.now().isoformat(),
-            'path': os.path.join(date_subdir, unique_filename),
-            'subdir': date_subdir
-        }
-        
-        save_metadata(metadata)
-        logger.info(f"Metadata saved for {unique_filename}")
+    except RequestEntityTooLarge:
+        return jsonify({'error': 'File too large'}), 413
+    except Exception as e:
+        logger.error(f"Upload error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/upload/raw', methods=['PUT'])
+def upload_raw():
+    """Загружает файл потоком, без буферизации всей загрузки в памяти.
+
+    Тело запроса - содержимое файла как есть, имя файла передается
+    в заголовке X-Filename (URL-encoded).
+    """
+    try:
+        if request.content_length is not None and request.content_length > MAX_CONTENT_LENGTH:
+            return jsonify({'error': 'File too large'}), 413
         
-        return jsonify({
-            'success': True,
-            'message': 'File uploaded successfully',
-            'file': metadata[file_id]
-        }), 200
+        filename = unquote(request.headers.get('X-Filename', ''))
+        return store_upload(filename, _copy_request_stream)
         
+    except RequestEntityTooLarge:
+        return jsonify({'error': 'File too large'}), 413
     except Exception as e:
         logger.error(f"Upload error: {e}")
         return jsonify({'error': str(e)}), 500
 
+_SIZE_UNITS = ('B', 'KB', 'MB', 'GB', 'TB')
+
+@app.template_filter('format_size')
 def format_size(size):
     """Форматирует размер файла в человеко-читаемый формат"""
-    for unit in ['B', 'KB', 'MB', 'GB']:
-        if size < 1024.0:
-            return f"{size:.1f} {unit}"
-        size /= 1024.0
-    return f"{size:.1f} TB"
+    if size <= 0:
+        return "0.0 B"
+    # Единица измерения определяется по числу бит: каждые 10 бит - следующая
+    k = min((size.bit_length() - 1) // 10, len(_SIZE_UNITS) - 1)
+    return f"{size / (1 << (10 * k)):.1f} {_SIZE_UNITS[k]}"
+
+def with_size_human(file):
+    """Добавляет к метаданным файла размер в читаемом виде (в БД не хранится)"""
+    return {**file, 'size_human': format_size(file['size'])}
 
 @app.route('/list')
 def list_files():
     """Возвращает список всех файлов с метаданными в JSON"""
     try:
-        metadata = load_metadata()
-        
-        # Сортируем по дате загрузки (новые сверху)
-        files_list = list(metadata.values())
-        files_list.sort(key=lambda x: x['upload_date'], reverse=True)
+        # Сортировка по дате загрузки (новые сверху) выполняется по индексу БД
+        files_list = query_files(request.args.get('limit', type=int))
+        total_files, _ = count_files()
         
-        return jsonify({
-            'total_files': len(files_list),
-            'files': files_list
+        return json_response({
+            'total_files': total_files,
+            'files': [with_size_human(file) for file in files_list]
         })
     except Exception as e:
         logger.error(f"List error: {e}")
         return jsonify({'error': str(e)}), 500
 
-def get_files_list():
-    """Вспомогательная функция для получения списка файлов для шаблона"""
-    try:
-        metadata = load_metadata()
-        files_list = list(metadata.values())
-        files_list.sort(key=lambda x: x['upload_date'], reverse=True)
-        return files_list
-    except Exception as e:
-        logger.error(f"Get files list error: {e}")
-        return []
-
 @app.route('/files/<filename>')
 def download_file(filename):
     """Скачивает конкретный файл"""
     try:
-        metadata = load_metadata()
+        file_info = get_file_info(filename)
         
         # Ищем файл по уникальному имени
-        if filename in metadata:
-            file_info = metadata[filename]
+        if file_info is not None:
             file_path = os.path.join(STORAGE_DIR, file_info['path'])
             
             if os.path.exists(file_path):
                 logger.info(f"Downloading file: {file_path}")
-                return send_file(
-                    file_path,
+                return send_from_directory(
+                    STORAGE_DIR,
+                    file_info['path'],
                     as_attachment=True,
-                    download_name=file_info['original_name']
+                    download_name=file_info['original_name'],
+                    conditional=True
                 )
         
-        # Если файл не найден в метаданных, пробуем прямой путь
-        for root, dirs, files in os.walk(STORAGE_DIR):
-            if filename in files:
-                file_path = os.path.join(root, filename)
+        # Файлы без метаданных ищем в индексе, построенном при старте
+        root = _UNTRACKED_FILES.get(filename)
+        if root is not None:
+            file_path = os.path.join(root, filename)
+            if os.path.exists(file_path):
                 logger.info(f"Downloading file (direct): {file_path}")
-                return send_file(
-                    file_path,
+                return send_from_directory(
+                    root,
+                    filename,
                     as_attachment=True,
-                    download_name=filename
+                    download_name=filename,
+                    conditional=True
                 )
+            # Файл удалили с диска после старта - убираем устаревшую запись
+            _UNTRACKED_FILES.pop(filename, None)
         
         return jsonify({'error': 'File not found'}), 404
         
+    except NotFound:
+        # Файл исчез между проверкой и отправкой
+        return jsonify({'error': 'File not found'}), 404
     except Exception as e:
         logger.error(f"Download error: {e}")
         return jsonify({'error': str(e)}), 500
@@ -208,18 +579,16 @@ def download_file(filename):
 def delete_file(filename):
     """Удаляет файл"""
     try:
-        metadata = load_metadata()
+        file_info = get_file_info(filename)
         
-        if filename in metadata:
-            file_info = metadata[filename]
+        if file_info is not None:
             file_path = os.path.join(STORAGE_DIR, file_info['path'])
             
             if os.path.exists(file_path):
                 os.remove(file_path)
                 logger.info(f"File deleted: {file_path}")
             
-            del metadata[filename]
-            save_metadata(metadata)
+            remove_file_info(filename)
             
             return jsonify({'success': True, 'message': 'File deleted successfully'})
         
@@ -233,30 +602,14 @@ def delete_file(filename):
 def stats():
     """Статистика хранилища"""
     try:
-        metadata = load_metadata()
-        total_size = sum(file['size'] for file in metadata.values())
-        
-        # Статистика по датам
-        stats_by_date = {}
-        for file in metadata.values():
-            date = file['upload_date'][:10]
-            if date not in stats_by_date:
-                stats_by_date[date] = {'count': 0, 'total_size': 0}
-            stats_by_date[date]['count'] += 1
-            stats_by_date[date]['total_size'] += file['size']
+        total_files, total_size = count_files()
         
-        return jsonify({
-            'total_files': len(metadata),
+        return json_response({
+            'total_files': total_files,
             'total_size': total_size,
             'total_size_human': format_size(total_size),
-            'stats_by_date': stats_by_date
+            'stats_by_date': query_stats_by_date()
         })
     except Exception as e:
         logger.error(f"Stats error: {e}")
         return jsonify({'error': str(e)}), 500
-
-if __name__ == '__main__':
-    # Получаем порт из переменной окружения или используем 5000
-    port = int(os.environ.get('PORT', 5000))
-    logger.info(f"Starting Flask app on port {port}")
-    app.run(host='0.0.0.0', port=port, debug=True)
@@ -0,0 +1,30 @@
+# Конфигурация gunicorn: gunicorn app:app (файл подхватывается автоматически)
+import multiprocessing
+import os
+
+# Порт из переменной окружения или 5000
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+
+# Обработчики в основном ждут диск и сеть, поэтому в каждом процессе
+# несколько потоков; число процессов - по числу ядер
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+# С GUNICORN_WORKER_CLASS=gevent загрузка, ждущая данных от клиента,
+# не занимает поток: чтение тела запроса уступает управление другим
+# запросам, и один процесс обслуживает до worker_connections загрузок
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))
+
+# Периодический перезапуск воркеров против утечек памяти
+max_requests = 10000
+max_requests_jitter = 1000
+
+# preload_app не включаем: соединение с SQLite открывается при импорте
+# приложения и не должно наследоваться воркерами через fork
+
+# Тело файла при скачивании копирует ядро через sendfile(2): send_file
+# отдает открытый файл в wsgi.file_wrapper, и gunicorn не читает его в Python.
+# sendfile в gunicorn включен по умолчанию; здесь его не задаем, чтобы
+# оставить отключение через SENDFILE=0 / --no-sendfile для файловых систем,
+# где sendfile(2) работает некорректно (bind-монтирования в контейнерах)
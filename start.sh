@@ -3,10 +3,10 @@ echo "🚀 Запускаем Cloud Storage приложение..."
 cd /workspaces/codespaces-flask/cloud-app
 
 # Очищаем старые процессы
-pkill -f python 2>/dev/null
+pkill -f gunicorn 2>/dev/null
 
-# Запускаем приложение
-python app.py &
+# Запускаем приложение (настройки в gunicorn.conf.py)
+gunicorn app:app &
 
 # Ждем запуска
 sleep 3